@@ -39,6 +39,9 @@ parser.add_argument(
 )
 parser.add_argument('--use_easymac', action='store_true')
 parser.add_argument('--lr', type=float, default=1e-3)
+parser.add_argument('--area_w', type=float, default=0.01)
+parser.add_argument('--emit_best', action='store_true',
+    help='print the best log row (scored with area_w) as a final "BEST\t<row>" stdout line')
 args = parser.parse_args()
 
 
@@ -211,6 +214,7 @@ def main():
         strftime = args.strftime
     flog = open("mult_logs/mult_{}b_{}.log".format(args.input_bit, strftime), "w")
     cnt = 0
+    best_row, best_row_score = None, float("inf")
     for i_epoch in range(100000):
         score = 0
         state = env.reset()
@@ -234,14 +238,25 @@ def main():
         training_records.append(TrainRecord(i_epoch, running_reward))
         if i_epoch % 10 ==0:
             print("Epoch {}, Moving average score is: {:.2f}, this score is: {:.2f}".format(i_epoch, running_reward, score))
-        flog.write("{}\t{:.2f}\t{:.0f}\t{:.2f}\t{:.0f}\t{}\t{}\n".format(env.verilog_file_name, 
+        row = "{}\t{:.2f}\t{:.0f}\t{:.2f}\t{:.0f}\t{}\t{}".format(env.verilog_file_name, 
             info["delay"], info["area"],
             info["delay_wo"], info["area_wo"],
-            env.fa, env.ha))
+            env.fa, env.ha)
+        flog.write(row + "\n")
+        if args.emit_best:
+            # Score the rounded values, exactly as mult.py would parse them from the log
+            parts = row.split("\t")
+            row_score = (float(parts[1]) + float(parts[2]) * args.area_w +
+                float(parts[3]) + float(parts[4]) * args.area_w)
+            if row_score < best_row_score:
+                best_row, best_row_score = row, row_score
         cnt += 1
         if cnt >= args.max_iter:
             break
         flog.flush()
+    flog.close()
+    if args.emit_best and best_row is not None:
+        print("BEST\t{}".format(best_row), flush=True)
 
 if __name__ == '__main__':
     main()
@@ -1,25 +1,66 @@
 import os
+import glob
+import hashlib
+import shutil
+import mmap
+import re
 import time
 import subprocess
-import selectors
-import io
 import sys
+import threading
 import argparse
+from collections import namedtuple
+
+import numpy as np
 
 ###############################################################################
 # Global Configurations
 ###############################################################################
 BASE_DIR = "/content/ArithmeticTree"
 
+# Set ATREE_VERBOSE to print which logs are being parsed.
+VERBOSE = os.environ.get("ATREE_VERBOSE")
+
+# Absolute interpreter path for the PPO/MCTS children (needed for posix_spawn).
+PYTHON = shutil.which("python3") or sys.executable
+# The children are relaunched many times, so skip writing .pyc files on each
+# start. '-S' is not used since they import torch/gymnasium from site-packages.
+CHILD_ENV = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+
 # These directories must exist or be created.
 MULT_LOGS_DIR = os.path.join(BASE_DIR, "mult_logs")
 MCTS_LOGS_DIR = os.path.join(BASE_DIR, "mcts_mult_adder")
 BACK_AND_FORTH_DIR = os.path.join(BASE_DIR, "back_and_forth")
+MULT_TEMPLATE_DIR = os.path.join(BASE_DIR, "multiplier_template")
+ADDER_TEMPLATE_DIR = os.path.join(BASE_DIR, "adder_template")
+CACHE_DIR = os.path.join(BASE_DIR, ".cache")
+
+# Written by the PPO/MCTS children; read here.
+MULT_MID_DIR = os.path.join(BASE_DIR, "run_verilog_mult_mid")
+MULT_ADD_MID_DIR = os.path.join(BASE_DIR, "run_verilog_mult_add_mid")
+PPO_SCRIPT = os.path.join(BASE_DIR, "PPO2_mult.py")
+MCTS_SCRIPT = os.path.join(BASE_DIR, "MCTS_mult.py")
+MULT_ENV_DIR = os.path.join(BASE_DIR, "multiplier_env")
+
+EACH_ITER_PPO = 900
+EACH_ITER_MCTS = 100
+TOTAL_TIMES = 3
+# Relative MCTS score improvement below which the serial flow skips an iteration
+CONVERGENCE_TOL = 1e-3
+
+# Byte sentinels for slicing the generated Verilog files.
+ADDER_MARK = b"module adder(a,b,s);"
+COMMENT_MARK = b"//"
+TWO = b"2"
+# Prefix of the final stdout line printed by 'PPO2_mult.py --emit_best'
+BEST_MARK = b"BEST\t"
 
 # Create directories if they don't exist
 os.makedirs(MULT_LOGS_DIR, exist_ok=True)
 os.makedirs(MCTS_LOGS_DIR, exist_ok=True)
 os.makedirs(BACK_AND_FORTH_DIR, exist_ok=True)
+os.makedirs(MULT_TEMPLATE_DIR, exist_ok=True)
+os.makedirs(ADDER_TEMPLATE_DIR, exist_ok=True)
 
 ###############################################################################
 # Argument Parser
@@ -27,124 +68,353 @@ os.makedirs(BACK_AND_FORTH_DIR, exist_ok=True)
 parser = argparse.ArgumentParser(description="multiplier design")
 parser.add_argument("--input_bit", type=int, default=16, help="Bit-width of the multiplier")
 parser.add_argument("--area_w", type=float, default=0.01, help="Weight for area in scoring")
+parser.add_argument("--no_cache", action="store_true",
+                    help="Always rerun PPO/MCTS instead of reusing logs from identical earlier runs")
 args = parser.parse_args()
 
+# The run cache is only needed when it is in use.
+if not args.no_cache:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Formatted once. Both children get the exact weight mult.py scores with (repr
+# round-trips the float), so PPO's BEST row, MCTS's search and the log parse
+# here all agree; the rounded form only names the final log.
+AREA_W_ARG = repr(args.area_w)
+AREA_W_STR = f"{args.area_w:.2f}"
+
 ###############################################################################
 # Subprocess Output Capture
 ###############################################################################
-def capture_subprocess_output(subprocess_args):
+def capture_subprocess_output(subprocess_args, output_sink=None, env=CHILD_ENV):
     """
     Runs a subprocess and captures its output in real-time.
+    If given, 'output_sink' is called with each block of raw output bytes;
+    it is dropped for the rest of the run if it raises. An error while
+    mirroring to stdout kills the child and is re-raised here.
     Returns (success: bool, output: str).
     """
+    # close_fds=False and an absolute executable let CPython launch the child
+    # via posix_spawn instead of fork+exec; fds opened by Python are
+    # non-inheritable anyway. Keep preexec_fn/pass_fds/cwd unset for the same
+    # reason.
     process = subprocess.Popen(
         subprocess_args,
-        bufsize=1,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        universal_newlines=True
+        close_fds=False,
+        env=env
     )
-    buf = io.StringIO()
-
-    def handle_output(stream, mask):
-        line = stream.readline()
-        buf.write(line)
-        sys.stdout.write(line)
-
-    selector = selectors.DefaultSelector()
-    selector.register(process.stdout, selectors.EVENT_READ, handle_output)
-
-    # Poll until process completes
-    while process.poll() is None:
-        events = selector.select()
-        for key, mask in events:
-            callback = key.data
-            callback(key.fileobj, mask)
-
+    # Raw bytes are collected as-is and decoded once at the end.
+    buf = bytearray()
+    mirror_errors = []
+    sys.stdout.flush()
+    stdout_fd = sys.stdout.fileno()
+
+    def handle_output(fd):
+        # Mirror the child's output in 64 KiB blocks rather than per line.
+        sink = output_sink
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            buf.extend(chunk)
+            view = memoryview(chunk)
+            try:
+                while view:
+                    view = view[os.write(stdout_fd, view):]
+            except OSError as e:
+                # e.g. BrokenPipeError under '| head': stop the child so that
+                # process.wait() returns, and re-raise on the main thread.
+                mirror_errors.append(e)
+                process.kill()
+                break
+            if sink is not None:
+                # The pipe must keep draining whatever the sink does, or the
+                # child blocks on write and process.wait() never returns.
+                try:
+                    sink(chunk)
+                except Exception as e:
+                    print(f"[WARNING] Output sink failed, disabling it: {e!r}", file=sys.stderr)
+                    sink = None
+
+    reader = threading.Thread(target=handle_output, args=(process.stdout.fileno(),))
+    reader.start()
     return_code = process.wait()
-    selector.close()
+    reader.join()
+    process.stdout.close()
+    if mirror_errors:
+        raise mirror_errors[0]
+
     success = (return_code == 0)
-    output = buf.getvalue()
-    buf.close()
+    output = buf.decode("utf-8", errors="replace")
+    return success, output
+
+def _subprocess_cache_key(subprocess_args, template_path=None):
+    """
+    Hashes the argv plus the template contents and the child's sources (the
+    script itself and multiplier_env), so editing the child code invalidates
+    old entries. The values of '--strftime' and '--template' are left out
+    since they only carry the per-run timestamp.
+    """
+    key_args = []
+    skip = False
+    for arg in subprocess_args:
+        if skip:
+            skip = False
+            continue
+        if arg in ("--strftime", "--template"):
+            skip = True
+        key_args.append(arg)
+    h = hashlib.blake2b(b"\0".join(a.encode() for a in key_args), digest_size=16)
+    source_paths = [subprocess_args[1]] + sorted(glob.glob(os.path.join(MULT_ENV_DIR, "*.py")))
+    if template_path is not None:
+        source_paths.append(template_path)
+    for path in source_paths:
+        with open(path, "rb") as fopen:
+            h.update(b"\0" + fopen.read())
+    return h.hexdigest()
+
+def capture_cached_subprocess_output(subprocess_args, log_path, verilog_dir,
+                                     template_path=None, output_sink=None):
+    """
+    Like capture_subprocess_output, but reuses the log of an earlier successful
+    run with the same argv/template/child code: it is copied to 'log_path' and
+    the subprocess is skipped. An entry only counts as a hit while the best
+    row's Verilog file is still present in 'verilog_dir'.
+    Returns (success: bool, output: str).
+    """
+    if args.no_cache:
+        return capture_subprocess_output(subprocess_args, output_sink)
+
+    cache_path = os.path.join(CACHE_DIR, _subprocess_cache_key(subprocess_args, template_path) + ".log")
+    if os.path.exists(cache_path):
+        best_verilog_file, _ = _best_from_log(cache_path, args.area_w)
+        if best_verilog_file is None or not os.path.exists(os.path.join(verilog_dir, best_verilog_file)):
+            print("Ignoring cached log with missing Verilog files:", cache_path)
+            return _capture_and_cache(subprocess_args, log_path, cache_path, output_sink)
+        print("Reusing cached log:", cache_path)
+        shutil.copyfile(cache_path, log_path)
+        return True, ""
+
+    return _capture_and_cache(subprocess_args, log_path, cache_path, output_sink)
+
+def _capture_and_cache(subprocess_args, log_path, cache_path, output_sink):
+    success, output = capture_subprocess_output(subprocess_args, output_sink)
+    if success and os.path.exists(log_path):
+        shutil.copyfile(log_path, cache_path)
+        # The entry may have been read by the hit check above; forget that
+        # parse state so the rewritten file is parsed from scratch.
+        _LOG_CACHE.pop(cache_path, None)
     return success, output
 
 ###############################################################################
 # Utility Functions for Reading/Writing Files
 ###############################################################################
+# Per-log parse state, keyed by log_path, with one array entry per parsed row.
+# The PPO/MCTS logs are append-only, so a repeated lookup only has to
+# parse the bytes written since the previous call. The raw metric columns
+# are kept rather than scores, so a different area_w needs no reparse.
+_LogState = namedtuple("_LogState", ["mtime_ns", "ino", "offset", "tail", "names", "cols", "lines"])
+_LOG_CACHE = {}
+# Bytes before the last parsed offset that must be unchanged to resume.
+_LOG_TAIL_BYTES = 256
+
+def _scores(cols, area_w):
+    return cols[:, 0] + cols[:, 1] * area_w + cols[:, 2] + cols[:, 3] * area_w
+
+def _line_score(data_line):
+    parts = data_line.split("\t")
+    return (float(parts[1]) + float(parts[2]) * args.area_w +
+            float(parts[3]) + float(parts[4]) * args.area_w)
+
+def _parse_log(log_path):
+    """
+    Returns (names, cols, lines) for every complete row of the PPO/MCTS log
+    at 'log_path', where cols is the (N, 4) float64 array of metric columns,
+    resuming from the offset reached by the previous call when the log has
+    only grown.
+    """
+    stat = os.stat(log_path)
+    empty = (np.empty(0, dtype=object), np.empty((0, 4), dtype=np.float64),
+             np.empty(0, dtype=object))
+    cached = _LOG_CACHE.get(log_path)
+    if cached is not None and cached.ino != stat.st_ino:
+        cached = None
+    if (cached is not None and cached.mtime_ns == stat.st_mtime_ns
+            and cached.offset == stat.st_size):
+        return cached.names, cached.cols, cached.lines
+
+    with open(log_path, "rb") as fopen:
+        # Resume only if the file provably grew by appending: same inode, no
+        # shorter, and the bytes just before the old offset are unchanged.
+        # Anything else (truncation, rewrite in place) is parsed from scratch.
+        last_offset, (names, cols, lines) = 0, empty
+        if cached is not None and stat.st_size >= cached.offset:
+            fopen.seek(cached.offset - len(cached.tail))
+            if fopen.read(len(cached.tail)) == cached.tail:
+                last_offset = cached.offset
+                names, cols, lines = cached.names, cached.cols, cached.lines
+        fopen.seek(last_offset)
+        data = fopen.read(stat.st_size - last_offset)
+
+    # Only consume complete lines; a trailing partial line is picked up later.
+    end = data.rfind(b"\n") + 1
+    # Blank lines are dropped up front so names/cols/lines stay row-aligned.
+    new_lines = [line for line in (raw.strip() for raw in data[:end].decode().splitlines()) if line]
+    if new_lines:
+        # Expected format: file_name, lat1, lat2, pwr1, pwr2 (?)
+        # Only columns 1-4 enter the score.
+        new_cols = np.loadtxt(new_lines, delimiter="\t", usecols=(1, 2, 3, 4),
+                              dtype=np.float64, ndmin=2, comments=None)
+        new_names = np.array([line.split("\t", 1)[0] for line in new_lines], dtype=object)
+        names = np.concatenate([names, new_names])
+        cols = np.concatenate([cols, new_cols])
+        lines = np.concatenate([lines, np.array(new_lines, dtype=object)])
+
+    # A partial trailing line leaves the size ahead of the offset, so the
+    # next call rescans it even if the mtime is unchanged.
+    offset = last_offset + end
+    if end > 0:
+        tail = data[max(0, end - _LOG_TAIL_BYTES):end]
+    else:
+        tail = cached.tail if last_offset > 0 else b""
+    _LOG_CACHE[log_path] = _LogState(stat.st_mtime_ns, stat.st_ino, offset, tail, names, cols, lines)
+    return names, cols, lines
+
+def _best_from_log(log_path, area_w):
+    """
+    Returns (best_verilog_filename, best_data_line) for the log at 'log_path'.
+    """
+    names, cols, lines = _parse_log(log_path)
+    scores = _scores(cols, area_w)
+    if scores.size == 0:
+        return None, None
+    best_idx = int(scores.argmin())
+    return names[best_idx], lines[best_idx]
+
+class BestTracker:
+    """
+    Follows a PPO/MCTS log while its subprocess is still running, so rows are
+    parsed as they are written instead of in one pass after the run.
+    A child started with '--emit_best' reports its winner as a final
+    'BEST\t<row>' stdout line, which then replaces the log lookup entirely;
+    with 'expect_best' the log is not polled at all and is only parsed if that
+    line never arrives.
+    Pass 'update' as the output sink of capture_subprocess_output.
+    """
+    poll_interval = 1.0
+
+    def __init__(self, log_path, area_w, expect_best=False):
+        self.log_path = log_path
+        self.area_w = area_w
+        self.expect_best = expect_best
+        self.last_poll = 0.0
+        self.best_line = None
+        self.pending = b""
+
+    def update(self, chunk=b""):
+        data = self.pending + chunk
+        if BEST_MARK in data:
+            for line in data[:data.rfind(b"\n") + 1].splitlines():
+                if line.startswith(BEST_MARK):
+                    self.best_line = line[len(BEST_MARK):].decode().strip()
+        # Keep the unfinished last line (tqdm redraws with '\r') for the next chunk.
+        self.pending = data[max(data.rfind(b"\n"), data.rfind(b"\r")) + 1:]
+        if self.best_line is not None or self.expect_best:
+            return
+
+        # Otherwise the output is only a wake-up; the rows themselves are in the log.
+        now = time.time()
+        if now - self.last_poll < self.poll_interval or not os.path.exists(self.log_path):
+            return
+        self.last_poll = now
+        _parse_log(self.log_path)
+
+    def best(self):
+        """
+        Returns (best_verilog_filename, best_data_line) after the run, from the
+        'BEST' line if one was seen; otherwise only the rows written since the
+        last poll still need parsing.
+        """
+        if self.best_line is not None:
+            return self.best_line.split("\t", 1)[0], self.best_line
+        assert os.path.exists(self.log_path), f"[ERROR] {self.log_path} does not exist."
+        return _best_from_log(self.log_path, self.area_w)
+
+def ppo_log_path(strftime_str, input_bit):
+    return os.path.join(MULT_LOGS_DIR, f"mult_{input_bit}b_{strftime_str}.log")
+
+def mcts_log_path(strftime_str, input_bit):
+    return os.path.join(MCTS_LOGS_DIR, f"mcts_mult_adder_{input_bit}b_openroad_{strftime_str}.log")
+
 def get_best_file_from_ppo(strftime_str, input_bit):
     """
     Reads the PPO logs and returns (best_verilog_filename, best_data_line).
+    run_chain() takes this from its BestTracker; this is kept for offline analysis.
     """
-    log_path = os.path.join(MULT_LOGS_DIR, f"mult_{input_bit}b_{strftime_str}.log")
-    print("Looking for PPO log:", log_path)
+    log_path = ppo_log_path(strftime_str, input_bit)
+    if VERBOSE:
+        print("Looking for PPO log:", log_path)
     assert os.path.exists(log_path), f"[ERROR] {log_path} does not exist."
 
-    best_score = float("inf")
-    best_verilog_file = None
-    best_data_line = None
-
-    with open(log_path, "r") as fopen:
-        for line in fopen:
-            raw_line = line.strip()
-            parts = raw_line.split("\t")
-            # Expected format: file_name, lat1, lat2, pwr1, pwr2 (?)
-            # The original code uses parts[1], parts[2], parts[3], parts[4]
-            score = (float(parts[1]) +
-                     float(parts[2]) * args.area_w +
-                     float(parts[3]) +
-                     float(parts[4]) * args.area_w)
-            if score < best_score:
-                best_score = score
-                best_verilog_file = parts[0]
-                best_data_line = raw_line
-
-    return best_verilog_file, best_data_line
+    return _best_from_log(log_path, args.area_w)
 
 def get_best_file_from_mcts(strftime_str, input_bit):
     """
     Reads the MCTS logs and returns (best_verilog_filename, best_data_line).
+    run_chain() takes this from its BestTracker; this is kept for offline analysis.
     """
-    log_path = os.path.join(MCTS_LOGS_DIR, f"mcts_mult_adder_{input_bit}b_openroad_{strftime_str}.log")
-    print("Looking for MCTS log:", log_path)
+    log_path = mcts_log_path(strftime_str, input_bit)
+    if VERBOSE:
+        print("Looking for MCTS log:", log_path)
     assert os.path.exists(log_path), f"[ERROR] {log_path} does not exist."
 
-    best_score = float("inf")
-    best_verilog_file = None
-    best_data_line = None
-
-    with open(log_path, "r") as fopen:
-        for line in fopen:
-            raw_line = line.strip()
-            parts = raw_line.split("\t")
-            score = (float(parts[1]) +
-                     float(parts[2]) * args.area_w +
-                     float(parts[3]) +
-                     float(parts[4]) * args.area_w)
-            if score < best_score:
-                best_score = score
-                best_verilog_file = parts[0]
-                best_data_line = raw_line
-
-    return best_verilog_file, best_data_line
+    return _best_from_log(log_path, args.area_w)
+
+_COMMENT_LINE_RE = re.compile(rb"^" + re.escape(COMMENT_MARK) + rb"[^\n]*(?:\n|\Z)", re.M)
+
+def _find_adder_marker(mm):
+    """
+    Returns the offset of the first line starting with 'module adder(a,b,s);', or -1.
+    """
+    if mm[:len(ADDER_MARK)] == ADDER_MARK:
+        return 0
+    pos = mm.find(b"\n" + ADDER_MARK)
+    return pos + 1 if pos >= 0 else -1
+
+def _normalize_newlines(data):
+    # The same translation text mode ('universal newlines') applies on read.
+    return data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+def _sendfile_range(fwrite, fopen, offset, end):
+    while offset < end:
+        offset += os.sendfile(fwrite.fileno(), fopen.fileno(), offset, end - offset)
 
 def save_mult_file(verilog_file_name, strftime_str):
     """
     Copies lines from 'run_verilog_mult_mid/<verilog_file_name>' to
     'multiplier_template/mult_template_<strftime_str>.v' until the 'module adder(a,b,s);' line.
     """
-    source_path = os.path.join(BASE_DIR, "run_verilog_mult_mid", verilog_file_name)
-    dest_dir = os.path.join(BASE_DIR, "multiplier_template")
-    os.makedirs(dest_dir, exist_ok=True)
-
+    source_path = os.path.join(MULT_MID_DIR, verilog_file_name)
     template_mult_name = f"mult_template_{strftime_str}.v"
-    dest_path = os.path.join(dest_dir, template_mult_name)
-
-    with open(source_path, "r") as fopen, open(dest_path, "w") as fwrite:
-        for line in fopen:
-            if not line.startswith("module adder(a,b,s);"):
-                fwrite.write(line)
-            else:
-                break
+    dest_path = os.path.join(MULT_TEMPLATE_DIR, template_mult_name)
+
+    with open(source_path, "rb") as fopen, open(dest_path, "wb") as fwrite:
+        end = os.fstat(fopen.fileno()).st_size
+        if end > 0:
+            with mmap.mmap(fopen.fileno(), 0, prot=mmap.PROT_READ) as mm:
+                if mm.find(b"\r") >= 0:
+                    # CR/CRLF files are translated as in text mode, which
+                    # rules out the raw in-kernel copy.
+                    data = _normalize_newlines(mm[:])
+                    pos = _find_adder_marker(data)
+                    fwrite.write(data if pos < 0 else data[:pos])
+                    return template_mult_name
+                pos = _find_adder_marker(mm)
+                if pos >= 0:
+                    end = pos
+        # Copy the prefix in-kernel.
+        _sendfile_range(fwrite, fopen, 0, end)
 
     return template_mult_name
 
@@ -154,32 +424,49 @@ def save_adder_file(verilog_file_name, strftime_str, input_bit):
     'adder_template/adder_template_<strftime_str>.v', starting at 'module adder(a,b,s);'
     or skipping lines starting with '//' unless they do not contain '2'.
     """
-    source_path = os.path.join(BASE_DIR, "run_verilog_mult_add_mid", verilog_file_name)
-    dest_dir = os.path.join(BASE_DIR, "adder_template")
-    os.makedirs(dest_dir, exist_ok=True)
-
+    source_path = os.path.join(MULT_ADD_MID_DIR, verilog_file_name)
     template_adder_name = f"adder_template_{strftime_str}.v"
-    dest_path = os.path.join(dest_dir, template_adder_name)
-
-    cnt = 0
-    find_adder = False
-
-    with open(source_path, "r") as fopen, open(dest_path, "w") as fwrite:
-        for line in fopen:
-            if not line.startswith("//"):
-                if line.startswith("module adder(a,b,s);"):
-                    find_adder = True
-                if find_adder:
-                    fwrite.write(line)
+    dest_path = os.path.join(ADDER_TEMPLATE_DIR, template_adder_name)
+
+    with open(source_path, "rb") as fopen, open(dest_path, "wb") as fwrite:
+        size = os.fstat(fopen.fileno()).st_size
+        if size == 0:
+            return template_adder_name
+        with mmap.mmap(fopen.fileno(), 0, prot=mmap.PROT_READ) as mm:
+            # CR/CRLF files are translated as in text mode and then sliced in
+            # memory; LF-only files are read straight from the mapping.
+            normalized = mm.find(b"\r") >= 0
+            src = _normalize_newlines(mm[:]) if normalized else mm
+            marker = _find_adder_marker(src)
+            head_end = len(src) if marker < 0 else marker
+
+            # Before the adder module only comment lines are kept: the first
+            # 'input_bit' of them that do not contain '2'.
+            kept = []
+            for m in _COMMENT_LINE_RE.finditer(src, 0, head_end):
+                if len(kept) >= input_bit:
+                    break
+                line = m.group()
+                if TWO not in line:
+                    kept.append(line)
+            fwrite.write(b"".join(kept))
+            if marker < 0:
+                return template_adder_name
+
+            if _COMMENT_LINE_RE.search(src, marker) is None:
+                if normalized:
+                    fwrite.write(src[marker:])
                 else:
-                    continue
+                    # The adder body is copied wholesale in-kernel.
+                    fwrite.flush()
+                    _sendfile_range(fwrite, fopen, marker, size)
             else:
-                # For lines starting with '//'
-                if "2" in line:
-                    # skip lines with '2'
-                    continue
-                else:
-                    if cnt < input_bit:
+                # Comments inside the body go through the same filter.
+                cnt = len(kept)
+                for line in src[marker:].splitlines(keepends=True):
+                    if not line.startswith(COMMENT_MARK):
+                        fwrite.write(line)
+                    elif TWO not in line and cnt < input_bit:
                         fwrite.write(line)
                         cnt += 1
     return template_adder_name
@@ -187,11 +474,98 @@ def save_adder_file(verilog_file_name, strftime_str, input_bit):
 ###############################################################################
 # Main
 ###############################################################################
+def build_cmd(script, **kwargs):
+    """
+    Builds the argv for running 'script' with PYTHON. Each keyword becomes
+    '--<name> <value>'; True adds a bare flag, while False/None are left out.
+    """
+    cmd = [PYTHON, script]
+    for name, value in kwargs.items():
+        if value is None or value is False:
+            continue
+        cmd.append(f"--{name}")
+        if value is not True:
+            cmd.append(str(value))
+    return cmd
+
+def run_chain(tag, template_adder_name=None):
+    """
+    Runs one PPO -> MCTS pass whose logs/templates are suffixed with 'tag'.
+    If 'template_adder_name' is given, PPO starts from that adder and MCTS
+    from its initial state, as in the later back-and-forth iterations.
+    Returns (log_lines, mcts_data_line, template_adder_name); the last two
+    are None if any step failed.
+    """
+    input_bit = args.input_bit
+    log_lines = []
+
+    # Decide arguments for PPO2_mult.py; --template only after the first iteration
+    ppo_cmd = build_cmd(
+        PPO_SCRIPT,
+        input_bit=input_bit,
+        max_iter=EACH_ITER_PPO,
+        strftime=tag,
+        area_w=AREA_W_ARG,
+        emit_best=True,
+        template=template_adder_name
+    )
+
+    # Run PPO (or reuse an identical earlier run); it reports its best row itself
+    ppo_tracker = BestTracker(ppo_log_path(tag, input_bit), args.area_w, expect_best=True)
+    success, ppo_output = capture_cached_subprocess_output(
+        ppo_cmd, ppo_log_path(tag, input_bit), MULT_MID_DIR,
+        None if template_adder_name is None else os.path.join(ADDER_TEMPLATE_DIR, template_adder_name),
+        ppo_tracker.update)
+    if not success:
+        log_lines.append(f"[ERROR] PPO2_mult.py failed during run {tag}.\nOutput:\n{ppo_output}\n")
+        return log_lines, None, None
+
+    # Taken from the BEST line; the PPO log is only parsed if it was missing
+    try:
+        verilog_file_name, data_line = ppo_tracker.best()
+        log_lines.append(f"PPO:\t{data_line}\n")
+    except AssertionError as e:
+        log_lines.append(str(e) + "\n")
+        return log_lines, None, None
+
+    # Save the multiplier file
+    template_mult_name = save_mult_file(verilog_file_name, tag)
+
+    # Decide arguments for MCTS_mult.py; --init_state only after the first iteration
+    mcts_cmd = build_cmd(
+        MCTS_SCRIPT,
+        input_bit=input_bit * 2,
+        max_iter=EACH_ITER_MCTS,
+        template=template_mult_name,
+        strftime=tag,
+        area_w=AREA_W_ARG,
+        init_state=template_adder_name is not None
+    )
+
+    # Run MCTS (or reuse an identical earlier run), scoring its log as it grows
+    mcts_tracker = BestTracker(mcts_log_path(tag, input_bit * 2), args.area_w)
+    success, mcts_output = capture_cached_subprocess_output(
+        mcts_cmd, mcts_log_path(tag, input_bit * 2), MULT_ADD_MID_DIR,
+        os.path.join(MULT_TEMPLATE_DIR, template_mult_name),
+        mcts_tracker.update)
+    if not success:
+        log_lines.append(f"[ERROR] MCTS_mult.py failed during run {tag}.\nOutput:\n{mcts_output}\n")
+        return log_lines, None, None
+
+    # The tracker has already scanned the MCTS log
+    try:
+        verilog_file_name, data_line = mcts_tracker.best()
+        log_lines.append(f"MCTS\t{data_line}\n")
+    except AssertionError as e:
+        log_lines.append(str(e) + "\n")
+        return log_lines, None, None
+
+    # Save the adder file
+    template_adder_name = save_adder_file(verilog_file_name, tag, input_bit * 2)
+    return log_lines, data_line, template_adder_name
+
 def main():
     input_bit = args.input_bit
-    each_iter_ppo = 900
-    each_iter_mcts = 100
-    total_times = 3
 
     # Timestamp for logs/files
     timestamp = time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime())
@@ -199,88 +573,40 @@ def main():
     # Create a final log file in 'back_and_forth'
     final_log_path = os.path.join(
         BACK_AND_FORTH_DIR,
-        f"bandf_{input_bit}b_{timestamp}_{args.area_w:.2f}.log"
+        f"bandf_{input_bit}b_{timestamp}_{AREA_W_STR}.log"
     )
     flog = open(final_log_path, "w")
 
     start_time = time.time()
 
-    for i in range(total_times):
+    # Each iteration starts from the adder template found by the previous one.
+    template_adder_name = None
+    prev_score = None
+    i = 0
+    while i < TOTAL_TIMES:
         flog.write(f"Iteration {i}, Time elapsed: {time.time() - start_time:.2f} seconds\n")
-        flog.flush()
-
-        # Decide arguments for PPO2_mult.py
-        ppo_cmd = [
-            "python3",
-            os.path.join(BASE_DIR, "PPO2_mult.py"),
-            "--input_bit", str(input_bit),
-            "--max_iter", str(each_iter_ppo),
-            "--strftime", f"{timestamp}-{i}"
-        ]
-
-        # If not the first iteration, include the --template arg
-        if i > 0:
-            ppo_cmd.extend(["--template", template_adder_name])
-
-        # Run PPO
-        success, ppo_output = capture_subprocess_output(ppo_cmd)
-        if not success:
-            flog.write(f"[ERROR] PPO2_mult.py failed during iteration {i}.\nOutput:\n{ppo_output}\n")
-            break
-
-        # Now parse the PPO log file
-        try:
-            verilog_file_name, data_line = get_best_file_from_ppo(f"{timestamp}-{i}", input_bit)
-            flog.write(f"PPO:\t{data_line}\n")
-            flog.flush()
-        except AssertionError as e:
-            flog.write(str(e) + "\n")
-            break
 
-        # Save the multiplier file
-        template_mult_name = save_mult_file(verilog_file_name, f"{timestamp}-{i}")
-
-        # Decide arguments for MCTS_mult.py
-        mcts_cmd = [
-            "python3",
-            os.path.join(BASE_DIR, "MCTS_mult.py"),
-            "--input_bit", str(input_bit * 2),
-            "--max_iter", str(each_iter_mcts),
-            "--template", template_mult_name,
-            "--strftime", f"{timestamp}-{i}",
-            "--area_w", f"{args.area_w:.2f}"
-        ]
-
-        # If not the first iteration, add '--init_state'
-        if i > 0:
-            mcts_cmd.append("--init_state")
-
-        # Run MCTS
-        success, mcts_output = capture_subprocess_output(mcts_cmd)
-        if not success:
-            flog.write(f"[ERROR] MCTS_mult.py failed during iteration {i}.\nOutput:\n{mcts_output}\n")
-            break
-
-        # Now parse the MCTS log file
-        try:
-            verilog_file_name, data_line = get_best_file_from_mcts(f"{timestamp}-{i}", input_bit * 2)
-            flog.write(f"MCTS\t{data_line}\n")
-            flog.flush()
-        except AssertionError as e:
-            flog.write(str(e) + "\n")
+        tag = f"{timestamp}-{i}"
+        log_lines, data_line, template_adder_name = run_chain(tag, template_adder_name)
+        # Flush once per finished PPO/MCTS pass rather than per line.
+        flog.writelines(log_lines)
+        flog.flush()
+        if template_adder_name is None:
             break
 
-        # Save the adder file
-        template_adder_name = save_adder_file(verilog_file_name, f"{timestamp}-{i}", input_bit * 2)
-
-        # NOTE: This line increments i inside the loop. If that's intentional, keep it.
-        # Otherwise, remove it or change your loop logic to avoid skipping iterations.
-        i += 1
+        # Skip the next iteration once the MCTS score has stopped improving;
+        # another pass from an unchanged template is unlikely to help.
+        score = _line_score(data_line)
+        if prev_score is not None and prev_score - score <= CONVERGENCE_TOL * prev_score:
+            flog.write(f"Converged at iteration {i}, skipping the next iteration\n")
+            i += 2
+        else:
+            i += 1
+        prev_score = score
 
     # Final time
     total_time = time.time() - start_time
     flog.write(f"Total Time Elapsed: {total_time:.2f} seconds\n")
-    flog.flush()
     flog.close()
 
 ###############################################################################